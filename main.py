@@ -3,10 +3,12 @@ Module to tinker with models, data loading and trainings
 """
 import cv2
 import numpy as np
-import csv
-import sys
+import pandas as pd
+import os
+import glob
+import hashlib
 import matplotlib.pyplot as plt
-from numba import njit, vectorize, prange
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Any, Tuple,Dict
 from nptyping import NDArray
 from sklearn.model_selection import train_test_split
@@ -26,10 +28,74 @@ ImageCollection = NDArray[(Any), Image]
 ImageSegCollection = NDArray[(Any), ImageSeg]
 ImageSegBinaryCollection = NDArray[(Any), ImageSegBinary]
 
-# For printing all nmumpy array values
-np.set_printoptions(threshold=np.inf)
+# Colors of the ground truth classes, indexed by their 1D value
+lblPalette = np.array([
+    [0, 0, 0], # 0 unlabeled
+    [128, 64, 128], # 1 paved-area
+    [0, 76, 130], # 2 dirt
+    [0, 102, 0], # 3 grass
+    [87, 103, 112], # 4 gravel
+    [168, 42, 28], # 5 water
+    [30, 41, 48], # 6 rocks
+    [89, 50, 0], # 7 pool
+    [35, 142, 107], # 8 vegetation
+    [70, 70, 70], # 9 roof
+    [156, 102, 102], # 10 wall
+    [12, 228, 254], # 11 window
+    [12, 148, 254], # 12 door
+    [153, 153, 190], # 13 fence
+    [153, 153, 153], # 14 fence-pole
+    [96, 22, 255], # 15 person
+    [0, 51, 102], # 16 dog
+    [150, 143, 9], # 17 car
+    [32, 11, 119], # 18 bicycle
+    [0, 51, 51], # 19 tree
+    [190, 250, 190], # 20 bald-tree
+    [146, 150, 112], # 21 ar-marker
+    [115, 135, 2], # 22 obstacle
+    [0, 0, 255] # 23 conflicting
+], dtype=np.int16)
 
-def loadFromDataSources(d_list: List[DataSources]) -> Tuple[List[Image], List[ImageSeg]]:
+def _packColors(img: NDArray) -> NDArray:
+    """
+    Function to pack the 3 color channels of each pixel into a single integer key
+    Args:
+        img: Numpy array whose last dimension holds the 3 color channels
+
+    Returns:
+        Numpy array of uint32 keys with the last dimension removed
+    """
+    return ((img[..., 0].astype(np.uint32) << 16)
+            | (img[..., 1].astype(np.uint32) << 8)
+            | img[..., 2].astype(np.uint32))
+
+# Packed palette colors sorted for the binary search done in rgb2oneDimLabel
+_lblKeys = _packColors(lblPalette)
+_lblKeysOrder = np.argsort(_lblKeys).astype(np.int16)
+_lblKeysSorted = _lblKeys[_lblKeysOrder]
+
+def _loadDataSource(row: DataSources) -> Tuple[Image, ImageSeg]:
+    """
+    Function to load and resize the original image and ground truth image of
+    a single DataSource
+    Args:
+        row: DataSource with the paths of the images
+
+    Returns:
+        A tuple with the original image and the ground truth image
+    """
+    auxData = cv2.imread(row["data"])
+    if auxData is None:
+        raise ValueError("Could not load image {}".format(row["data"]))
+    auxLbl = cv2.imread(row["label"])
+    if auxLbl is None:
+        raise ValueError("Could not load image {}".format(row["label"]))
+    auxData = cv2.resize(auxData, (304,304), interpolation=cv2.INTER_AREA)
+    # Nearest neighbour so that no new label colors are interpolated
+    auxLbl = cv2.resize(auxLbl, (304,304), interpolation=cv2.INTER_NEAREST)
+    return auxData, auxLbl
+
+def loadFromDataSources(d_list: List[DataSources]) -> Tuple[ImageCollection, ImageSegCollection]:
     """
     Function to load the original images and ground truth images from the paths
     given in the DataSources
@@ -37,62 +103,150 @@ def loadFromDataSources(d_list: List[DataSources]) -> Tuple[List[Image], List[Im
         d_list: List of DataSources
 
     Returns:
-        A tuple with a list of original images and a list of ground truth images
+        A tuple with the collection of original images and the collection of
+        ground truth images
     """
     if len(d_list) == 0:
         raise ValueError("Param is empty")
     if not isinstance(d_list[0], dict):
         raise TypeError("Param is not a dictionary list")
-    data = []
-    lbl = []
-    count = 0
     for row in d_list:
         if not "data" in row.keys() or not "label" in row.keys():
             raise ValueError("Param dictionaries do not contain the desired keys")
-        try:
-            count += 1
-            if count % 15 == 0:
-                print(count)
-            auxData = cv2.imread(row["data"])
-            auxLbl = cv2.imread(row["label"])
-            auxData = cv2.resize(auxData, (304,304))
-            auxLbl = cv2.resize(auxLbl, (304,304))
-            if auxData is not None:
-                data.append(auxData)
-            if auxLbl is not None:
-                lbl.append(auxLbl)
-        except ValueError:
-            sys.stderr.write("Could not load an image")
+    data = np.empty((len(d_list),304,304,3), dtype=np.uint8)
+    lbl = np.empty((len(d_list),304,304,3), dtype=np.uint8)
+
+    def loadInto(i: int) -> None:
+        data[i], lbl[i] = _loadDataSource(d_list[i])
+
+    # OpenCV releases the GIL while decoding, so threads load images in parallel
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    try:
+        # Consume the results so that loading errors are raised here
+        list(executor.map(loadInto, range(len(d_list))))
+    except Exception:
+        # Drop the queued images instead of loading them before failing
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
     return data, lbl
 
-def getItems(data_src: List[str],lbl_src: List[str]) -> Tuple[ImageCollection,ImageSegBinaryCollection]:
+def _read(data_path: tf.Tensor, lbl_path: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """
+    Function that reads the raw bytes of one image and its label inside the
+    tf.data graph
+    Args:
+        data_path: Path to the image that will be loaded as data
+        lbl_path: Path to the image that will be loaded as label
+
+    Returns:
+        Tuple with the encoded data image and the encoded label image
+    """
+    return tf.io.read_file(data_path), tf.io.read_file(lbl_path)
+
+def _decodeScaled(data_bytes: tf.Tensor, img_size: Tuple[int,int]) -> tf.Tensor:
     """
-    Funcion that opens and loads the imges given as paths for the data and labels
+    Function that decodes an image. Jpeg images are decoded at the smallest
+    1/1, 1/2, 1/4 or 1/8 scale that is still not smaller than the requested
+    size, which skips most of the IDCT work for large images. Any other format
+    is decoded at full size
+    Args:
+        data_bytes: Encoded image
+        img_size: Height and width the image will be resized to afterwards
+
+    Returns:
+        Decoded RGB image
+    """
+    def decodeJpeg() -> tf.Tensor:
+        shape = tf.io.extract_jpeg_shape(data_bytes)
+        scale = tf.minimum(shape[0] // img_size[0], shape[1] // img_size[1])
+        # The first branch whose condition holds is the one decoded
+        return tf.case([
+            (scale >= ratio, lambda ratio=ratio: tf.io.decode_jpeg(data_bytes, channels=3, ratio=ratio))
+            for ratio in (8, 4, 2)
+        ], default=lambda: tf.io.decode_jpeg(data_bytes, channels=3))
+
+    # Some datasets have files with a .jpg name that are not jpeg
+    img = tf.cond(tf.io.is_jpeg(data_bytes), decodeJpeg,
+                  lambda: tf.io.decode_image(data_bytes, channels=3, expand_animations=False))
+    img.set_shape((None, None, 3))
+    return img
+
+def _preprocess(data_bytes: tf.Tensor, lbl_bytes: tf.Tensor, img_size: Tuple[int,int]) -> Tuple[tf.Tensor, tf.Tensor]:
+    """
+    Function that decodes and resizes one image and its label inside the
+    tf.data graph
+    Args:
+        data_bytes: Encoded image that will be used as data
+        lbl_bytes: Encoded image that will be used as label
+        img_size: Height and width the images are resized to
+
+    Returns:
+        Tuple with the data image and the label image, both as uint8
+    """
+    img = _decodeScaled(data_bytes, img_size)
+    # Normalization is done by the model, keep the cached images as uint8
+    img = tf.cast(tf.round(tf.image.resize(img, img_size, method="bilinear")), tf.uint8)
+    lbl = tf.io.decode_png(lbl_bytes, channels=1)
+    lbl = tf.image.resize(lbl, img_size, method="nearest") - 1
+    # sparse_categorical_crossentropy takes the labels without channel axis
+    return img, tf.squeeze(lbl, axis=-1)
+
+def _removePartialCache(cache_file: str) -> None:
+    """
+    Function that deletes the files of a tf.data cache whose writing was
+    interrupted, which tf.data would otherwise refuse to open
+    Args:
+        cache_file: File prefix of the cache
+    """
+    if not glob.glob(glob.escape(cache_file) + "_*.lockfile"):
+        return
+    print("Removing partial cache {}".format(cache_file))
+    for path in glob.glob(glob.escape(cache_file) + ".*") + glob.glob(glob.escape(cache_file) + "_*"):
+        os.remove(path)
+
+def getDataset(data_src: List[str], lbl_src: List[str], batch_size: int, shuffle: bool = True,
+               cache_file: str = "", img_size: Tuple[int,int] = (224,224)) -> tf.data.Dataset:
+    """
+    Function that builds a tf.data pipeline which loads the images given as paths
+    for the data and labels
     Args:
         data_src: List with the paths to the images that will be loaded as data
         lbl_src: List with the paths to the images that will be loaded as labels
+        batch_size: Number of images per batch
+        shuffle: Whether to shuffle the images on every epoch
+        cache_file: File prefix where the decoded images are cached so that
+            later runs skip decoding. The cache is kept in memory if empty.
+            A key built from the sources and img_size is appended to the
+            prefix, so other sources never reuse the cache. Changes to the
+            preprocessing code are not detected, delete cache/ by hand after
+            them. A partial cache left by an interrupted run is removed, so
+            two runs must not share the same prefix at once
+        img_size: Height and width of the input of the net, the images are
+            resized only once to this size
 
     Returns:
-        Tuple with the collection of the data and the collection of the labels
+        Dataset yielding batches of data and labels
     """
-    count = 0
-    x = np.zeros((len(data_src),224,224,3),dtype=np.int32)
-    for j,path in enumerate(data_src):
-        count += 1
-        print("{}: {}".format(count,path))
-        x[j] = tf.keras.preprocessing.image.load_img(path,target_size=(224,224))
-    count = 0
-    y = np.zeros((len(data_src),224,224,1),dtype=np.int32)
-    for j,path in enumerate(lbl_src):
-        count += 1
-        print("{}: {}".format(count,path))
-        img = tf.keras.preprocessing.image.load_img(path,color_mode="grayscale",target_size=(224,224))
-        y[j] = np.expand_dims(img,2)
-        y[j] -= 1
-        
-    return x,y
-
-def loadCsvFile(filename: str) -> Tuple[List[Image], List[ImageSeg],List[DataSources]]:
+    if len(data_src) != len(lbl_src):
+        raise ValueError("Data and label lists must have the same length")
+    ds = tf.data.Dataset.from_tensor_slices((data_src, lbl_src))
+    # Interleave the file reads so that many of them are in flight at once
+    ds = ds.interleave(lambda d, l: tf.data.Dataset.from_tensors((d, l)).map(_read),
+                       cycle_length=16, num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.map(lambda d, l: _preprocess(d, l, img_size), num_parallel_calls=tf.data.AUTOTUNE)
+    if cache_file:
+        key = hashlib.sha1("\n".join(list(data_src) + list(lbl_src)).encode()).hexdigest()[:12]
+        cache_file = "{}_{}x{}_{}".format(cache_file, *img_size, key)
+        _removePartialCache(cache_file)
+    # Cache before shuffling so every epoch is still shuffled differently
+    ds = ds.cache(cache_file)
+    if shuffle:
+        # Bounded buffer so training starts before every image is decoded
+        ds = ds.shuffle(min(len(data_src), 1000))
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def loadCsvFile(filename: str) -> Tuple[ImageCollection, ImageSegCollection,List[DataSources]]:
     """
         Function to load original images and ground truth images from .csv file
         Args:
@@ -103,12 +257,10 @@ def loadCsvFile(filename: str) -> Tuple[List[Image], List[ImageSeg],List[DataSou
     """
     if not isinstance(filename, str):
         raise TypeError("Name is not a string")
-    with open(filename) as csvfile:
-        data_storage = list(csv.DictReader(csvfile, delimiter=";"))
-        train_dict, test_dict = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
-        train_dict, test_dict = train_test_split(data_storage,test_size=0.95,train_size=0.05,random_state=69)
-        data,lbl = loadFromDataSources(train_dict)
-        return data,lbl,test_dict
+    data_storage = pd.read_csv(filename, sep=";", usecols=["data", "label"])
+    train_df, test_df = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
+    data,lbl = loadFromDataSources(train_df.to_dict("records"))
+    return data,lbl,test_df.to_dict("records")
 
 def loadCsvFile2(filename: str) -> Tuple[List[str], List[str], List[str], List[str]]:
     """
@@ -121,16 +273,13 @@ def loadCsvFile2(filename: str) -> Tuple[List[str], List[str], List[str], List[s
     """
     if not isinstance(filename, str):
         raise TypeError("Name is not a string")
-    with open(filename) as csvfile:
-        reader = csv.reader(csvfile, delimiter=";")
-        next(reader)
-        data_storage = list(reader)
-        train_dict, test_dict = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
-        train_data_src = [d[0] for d in train_dict]
-        train_labl_src = [d[1] for d in train_dict]
-        test_data_src = [d[0] for d in test_dict]
-        test_labl_src = [d[1] for d in test_dict]
-        return train_data_src,train_labl_src, test_data_src,test_labl_src
+    data_storage = pd.read_csv(filename, sep=";", usecols=["data", "label"])
+    train_df, test_df = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
+    train_data_src = train_df["data"].tolist()
+    train_labl_src = train_df["label"].tolist()
+    test_data_src = test_df["data"].tolist()
+    test_labl_src = test_df["label"].tolist()
+    return train_data_src,train_labl_src, test_data_src,test_labl_src
 
 def oneDim2rgbLabel(imgBin: ImageSegBinaryCollection) -> ImageSegCollection:
     """
@@ -165,97 +314,16 @@ def oneDim2rgbLabel(imgBin: ImageSegBinaryCollection) -> ImageSegCollection:
         23 -> conflicting
 
     """
-    lblDict = {
-        "unlabeled": [0, 0, 0], # 0
-        "paved-area": [128, 64, 128], # 1
-        "dirt": [0, 76, 130], # 2
-        "grass": [0, 102, 0], # 3
-        "gravel": [87, 103, 112], # 4
-        "water": [168, 42, 28], # 5
-        "rocks": [30, 41, 48], # 6
-        "pool": [89, 50, 0], # 7
-        "vegetation": [35, 142, 107], # 8 
-        "roof": [70, 70, 70], # 9
-        "wall": [156, 102, 102], # 10
-        "window": [12, 228, 254], # 11
-        "door": [12, 148, 254], # 12
-        "fence": [153, 153, 190], # 13 
-        "fence-pole": [153, 153, 153], # 14
-        "person": [96, 22, 255], # 15
-        "dog": [0, 51, 102], # 16 
-        "car":[150, 143, 9], # 17
-        "bicycle": [32, 11, 119], # 18
-        "tree": [0, 51, 51],  # 19
-        "bald-tree": [190, 250, 190], # 20
-        "ar-marker": [146, 150, 112], # 21
-        "obstacle": [115, 135, 2], # 22
-        "conflicting": [0, 0, 255]  # 23
-    }
-     
     if len(imgBin.shape) != 4:
         raise TypeError("Array is not 4D")
     if imgBin.shape[3] != 1:
         raise ValueError("Array must have format (numImg, width, height, 1)")
-     
-    img = np.zeros((imgBin.shape[0],imgBin.shape[1],imgBin.shape[2], 3), dtype=np.int16)
-    count = 0
-    for i in range(imgBin.shape[0]):
-        for j in range(imgBin.shape[1]):
-            for k in range(img.shape[2]):
-                if imgBin[i, j, k] == 0:
-                    img[i, j, k, :]  = lblDict["unlabeled"]
-                elif imgBin[i, j, k] == 1:
-                    img[i, j, k, :] = lblDict["paved-area"]
-                elif imgBin[i, j, k] == 2:
-                    img[i, j, k, :] = lblDict["dirt"]
-                elif imgBin[i, j, k] == 3:
-                    img[i, j, k, :] = lblDict["grass"]
-                elif imgBin[i, j, k] == 4:
-                    img[i, j, k, :] = lblDict["gravel"]
-                elif imgBin[i, j, k] == 5:
-                    img[i, j, k, :] = lblDict["water"]
-                elif imgBin[i, j, k] == 6:
-                    img[i, j, k, :] = lblDict["rocks"]
-                elif imgBin[i, j, k] == 7:
-                    img[i, j, k, :] = lblDict["pool"]
-                elif imgBin[i, j, k] == 8:
-                    img[i, j, k, :] = lblDict["vegetation"]
-                elif imgBin[i, j, k] == 9:
-                    img[i, j, k, :] = lblDict["roof"]
-                elif imgBin[i, j, k] == 10:
-                    img[i, j, k, :] = lblDict["wall"]
-                elif imgBin[i, j, k] == 11:
-                    img[i, j, k, :] = lblDict["window"]
-                elif imgBin[i, j, k] == 12:
-                    img[i, j, k, :] = lblDict["door"]
-                elif imgBin[i, j, k] == 13:
-                    img[i, j, k, :] = lblDict["fence"]
-                elif imgBin[i, j, k] == 14:
-                    img[i, j, k, :] = lblDict["fence-pole"]
-                elif imgBin[i, j, k] == 15:
-                    img[i, j, k, :] = lblDict["person"]
-                elif imgBin[i, j, k] == 16:
-                    img[i, j, k, :] = lblDict["dog"]
-                elif imgBin[i, j, k] == 17:
-                    img[i, j, k, :] = lblDict["car"]
-                elif imgBin[i, j, k] == 18:
-                    img[i, j, k, :] = lblDict["bicycle"]
-                elif imgBin[i, j, k] == 19:
-                    img[i, j, k, :] = lblDict["tree"]
-                elif imgBin[i, j, k] == 20:
-                    img[i, j, k, :] = lblDict["bald-tree"]
-                elif imgBin[i, j, k] == 21:
-                    img[i, j, k, :] = lblDict["ar-marker"]
-                elif imgBin[i, j, k] == 22:
-                    img[i, j, k, :] = lblDict["obstacle"]
-                elif imgBin[i, j, k] == 23:
-                    img[i, j, k] = lblDict["conflicting"]
-        count += 1
-        if count % 15 == 0:
-            print("Converted {} images to 3D".format(count))
-    return img
 
-@njit(parallel=True)
+    idx = imgBin[..., 0].astype(np.intp, copy=False)
+    # Values outside the known classes are painted as unlabeled
+    idx = np.where((idx >= 0) & (idx < len(lblPalette)), idx, 0)
+    return lblPalette[idx]
+
 def rgb2oneDimLabel(img: ImageSegCollection) -> ImageSegBinaryCollection:
     """
     Function to convert 3D ground truth images to 1D numeric values
@@ -289,66 +357,20 @@ def rgb2oneDimLabel(img: ImageSegCollection) -> ImageSegBinaryCollection:
         23 -> conflicting
 
     """
-    imgBin = np.zeros((img.shape[0],img.shape[1],img.shape[2], 1), dtype=np.int16)
-    for i in prange(img.shape[0]):
-        for j in prange(img.shape[1]):
-            for k in prange(img.shape[2]):
-                if np.array_equal(img[i, j, k, :], [0, 0, 0]):
-                    imgBin[i,j] = 0
-                elif np.array_equal(img[i, j, k, :], [128, 64, 128]):
-                    imgBin[i,j] = 1
-                elif np.array_equal(img[i, j, k, :], [0, 76, 130]):
-                    imgBin[i,j] = 2
-                elif np.array_equal(img[i, j, k, :], [0, 102, 0]):
-                    imgBin[i,j] = 3
-                elif np.array_equal(img[i, j, k, :], [87, 103, 112]):
-                    imgBin[i,j] = 4
-                elif np.array_equal(img[i, j, k, :], [168, 42, 28]):
-                    imgBin[i,j] = 5
-                elif np.array_equal(img[i, j, k, :], [30, 41, 48]):
-                    imgBin[i,j] = 6
-                elif np.array_equal(img[i, j, k, :], [89, 50, 0]):
-                    imgBin[i,j] = 7
-                elif np.array_equal(img[i, j, k, :], [35, 142, 107]):
-                    imgBin[i,j] = 8
-                elif np.array_equal(img[i, j, k, :], [70, 70, 70]):
-                    imgBin[i,j] = 9
-                elif np.array_equal(img[i, j, k, :], [156, 102, 102]):
-                    imgBin[i,j] = 10
-                elif np.array_equal(img[i, j, k, :], [12, 228, 254]):
-                    imgBin[i,j] = 11
-                elif np.array_equal(img[i, j, k, :], [12, 148, 254]):
-                    imgBin[i, j] = 12
-                elif np.array_equal(img[i, j, k, :], [153, 153, 190]):
-                    imgBin[i, j] = 13
-                elif np.array_equal(img[i, j, k, :], [153, 153, 153]):
-                    imgBin[i, j] = 14
-                elif np.array_equal(img[i, j, k, :], [96, 22, 255]):
-                    imgBin[i, j] = 15
-                elif np.array_equal(img[i, j, k, :], [0, 51, 102]):
-                    imgBin[i, j] = 16
-                elif np.array_equal(img[i, j, k, :], [150, 143, 9]):
-                    imgBin[i, j] = 17
-                elif np.array_equal(img[i, j, k, :], [32, 11, 119]):
-                    imgBin[i, j] = 18
-                elif np.array_equal(img[i, j, k, :], [0, 51, 51]):
-                    imgBin[i, j] = 19
-                elif np.array_equal(img[i, j, k, :], [190, 250, 190]):
-                    imgBin[i, j] = 20
-                elif np.array_equal(img[i, j, k, :], [146, 150, 112]):
-                    imgBin[i, j] = 21
-                elif np.array_equal(img[i, j, k, :], [115, 135, 2]):
-                    imgBin[i, j] = 22
-                elif np.array_equal(img[i, j, k, :], [0, 0, 255]):
-                    imgBin[i, j] = 23
+    keys = _packColors(img)
+    pos = np.searchsorted(_lblKeysSorted, keys)
+    pos = np.minimum(pos, len(_lblKeysSorted) - 1)
+    # Colors not present in the palette are treated as unlabeled
+    found = _lblKeysSorted[pos] == keys
+    imgBin = np.where(found, _lblKeysOrder[pos], 0).astype(np.int16)
     print("Images converted")
-    return imgBin
+    return imgBin[..., np.newaxis]
 
 if __name__ == "__main__":
 
     # Clear gpu session
     tf.keras.backend.clear_session()
-    
+
     # Limit gpu memory. Unncomment to set limit to 2GB
     gpus = tf.config.list_physical_devices('GPU')
     if gpus:
@@ -360,40 +382,52 @@ if __name__ == "__main__":
                     # [tf.config.experimental.VirtualDeviceConfiguration(memory_limit=2048)])
         except RuntimeError:
             print("Invalid GPU configuration")
+        # Run the layers in float16 keeping the weights in float32. Loss scaling is
+        # applied automatically by fit. Older GPUs and CPUs only emulate float16
+        if all(tf.config.experimental.get_device_details(gpu).get('compute_capability', (0,0)) >= (7,0)
+               for gpu in gpus):
+            tf.keras.mixed_precision.set_global_policy('mixed_float16')
 
     # Set where the channels are specified
     tf.keras.backend.set_image_data_format("channels_last")
 
+    # Net params
+    numClasses = 3
+    nEpochs = 150
+    batchSize = 32
+    imgSize = (224,224)
+    validationSplit = 0.3
+
     # data, lbl, test_dict = loadCsvFile('img.csv')
     train_data_src,train_labl_src, test_data_src,test_labl_src = loadCsvFile2('dogCat.csv')
-    data,lbl = getItems(train_data_src,train_labl_src)
-    # Normalize data
-    # data = np.array(data, dtype=np.float32)
-    data = data / 255.0
+    # Hold out the last part of the training images for validation
+    nVal = int(len(train_data_src) * validationSplit)
+    if nVal == 0:
+        raise ValueError("Not enough training images to hold out a validation set")
+    nTrain = len(train_data_src) - nVal
+    # Decoded images are cached on disk to skip decoding in later runs
+    os.makedirs("cache", exist_ok=True)
+    trainDs = getDataset(train_data_src[:nTrain], train_labl_src[:nTrain], batchSize,
+                         cache_file="cache/train", img_size=imgSize)
+    valDs = getDataset(train_data_src[nTrain:], train_labl_src[nTrain:], batchSize, shuffle=False,
+                       cache_file="cache/val", img_size=imgSize)
     # Convert labels from 3 to 1 dimension
     # lbl = np.array(lbl, dtype=np.int32)
     # lblBin = rgb2oneDimLabel(lbl)
 
-
-    # Net params
-    numClasses = 3
-    nEpochs = 150
-    batchSize = 32
-
-    net: UNetX = UNetX(img_size=(224,224,3),n_filters=[32,64,128,256,256,128,64,32], n_classes=numClasses)
+    net: UNetX = UNetX(img_size=imgSize + (3,),n_filters=[32,64,128,256,256,128,64,32], n_classes=numClasses)
     net.summary()
 
     net.compile(loss='sparse_categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
 
 
-    # Create checkpoints to save different models
-    path = "resultTraining/weightsEpoch_{epoch:02d}_valLoss_{val_loss:.2f}.hdf5"
-    path2 = "resultTraining/bestModel.hdf5"
+    # Save the best model and stop once the validation loss stops improving
+    path = "resultTraining/bestModel.hdf5"
     checkpoint = ModelCheckpoint(path, monitor='val_loss', verbose=1, save_best_only=True)
-    checkpoint2 = ModelCheckpoint(path2, monitor='val_loss', verbose=1, save_best_only=True)
-    callbackList = [checkpoint, checkpoint2]
+    earlyStopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
+    callbackList = [checkpoint, earlyStopping]
 
-    history = net.fit(data, lbl, validation_split=0.3, epochs=nEpochs, batch_size=batchSize, callbacks=callbackList)
+    history = net.fit(trainDs, validation_data=valDs, epochs=nEpochs, callbacks=callbackList)
 
     # Loss Curves
     plt.figure(figsize=[8,6])
@@ -33,6 +33,9 @@ class UNetX(_keras.Model):
         ## Imput of the network
         in_l = _keras.Input(shape=img_size)
 
+        ## Normalization of the raw [0,255] images
+        self._rescale = _keras.layers.Rescaling(1./255) # (x)
+
         ## First half of the network
         ## Downsampling
         ## Block 0
@@ -134,7 +137,8 @@ class UNetX(_keras.Model):
 
         ## Block 8
         ## Output
-        self._outputs = _keras.layers.Conv2D(n_classes,3,activation="softmax",padding="same")#(x)
+        # Kept in float32 so the softmax is stable under mixed precision
+        self._outputs = _keras.layers.Conv2D(n_classes,3,activation="softmax",padding="same",dtype="float32")#(x)
         self.out = self.call(in_l)
         super().__init__(inputs=in_l,outputs=self.out)
 
@@ -160,6 +164,9 @@ class UNetX(_keras.Model):
             ```
         """
         x = inputs
+        ## Normalization
+        x = self._rescale(x)
+
         ## Block 0
         # Entry
         x = self._conv1(x)
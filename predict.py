@@ -3,10 +3,9 @@ Module to predict with previously trained model
 """
 import cv2
 import numpy as np
-import csv
+import pandas as pd
 import sys
 import matplotlib.pyplot as plt
-from numba import njit, vectorize, prange
 from typing import List, Any, Tuple,Dict
 from nptyping import NDArray
 from sklearn.model_selection import train_test_split
@@ -27,24 +26,20 @@ ImageCollection = NDArray[(Any), Image]
 ImageSegCollection = NDArray[(Any), ImageSeg]
 ImageSegBinaryCollection = NDArray[(Any), ImageSegBinary]
 
-# For printing all nmumpy array values
-np.set_printoptions(threshold=np.inf)
-
 def getItems(data_src: List[str],lbl_src: List[str]) -> Tuple[ImageCollection, ImageSegBinaryCollection]:
     count = 0
-    x = np.zeros((len(data_src),224,224,3),dtype=np.int32)
+    x = np.empty((len(data_src),224,224,3),dtype=np.uint8)
     for j,path in enumerate(data_src):
         count += 1
         print("{}: {}".format(count,path))
         x[j] = tf.keras.preprocessing.image.load_img(path,target_size=(224,224))
     count = 0
-    y = np.zeros((len(data_src),224,224,1),dtype=np.int32)
+    y = np.empty((len(data_src),224,224),dtype=np.uint8)
     for j,path in enumerate(lbl_src):
         count += 1
         print("{}: {}".format(count,path))
         img = tf.keras.preprocessing.image.load_img(path,color_mode="grayscale",target_size=(224,224))
-        y[j] = np.expand_dims(img,2)
-        y[j] -= 1
+        y[j] = np.asarray(img, dtype=np.uint8) - 1
         
     return x,y
  
@@ -59,16 +54,13 @@ def loadCsvFile(filename: str) -> Tuple[List[str], List[str], List[str], List[st
     """
     if not isinstance(filename, str):
         raise TypeError("Name is not a string")
-    with open(filename) as csvfile:
-        reader = csv.reader(csvfile, delimiter=";")
-        next(reader)
-        data_storage = list(reader)
-        train_dict, test_dict = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
-        train_data_src = [d[0] for d in train_dict]
-        train_labl_src = [d[1] for d in train_dict]
-        test_data_src = [d[0] for d in test_dict]
-        test_labl_src = [d[1] for d in test_dict]
-        return train_data_src,train_labl_src, test_data_src,test_labl_src
+    data_storage = pd.read_csv(filename, sep=";", usecols=["data", "label"])
+    train_df, test_df = train_test_split(data_storage,test_size=0.3,train_size=0.7,random_state=69)
+    train_data_src = train_df["data"].tolist()
+    train_labl_src = train_df["label"].tolist()
+    test_data_src = test_df["data"].tolist()
+    test_labl_src = test_df["label"].tolist()
+    return train_data_src,train_labl_src, test_data_src,test_labl_src
      
 if __name__ == "__main__":
 
@@ -101,12 +93,11 @@ if __name__ == "__main__":
 
     # Load test values
     dataTest, lblTest = getItems(test_data_src, test_labl_src)
-    # Normalize data and convert lbl from 3 to 1 dimension
-    dataTest = dataTest / 255.0
+    # Data is normalized inside the model
 
     # Print random predicted image, mask, ground truth for testing
     test1 = dataTest[5,:,:,:]
-    lbl1 = lblTest[5,:,:,:]
+    lbl1 = lblTest[5,:,:]
     test = np.expand_dims(test1, 0)
     dataPredict = net.predict(test)
     mask = np.argmax(dataPredict[0], axis=-1)